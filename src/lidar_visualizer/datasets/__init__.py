@@ -45,6 +45,7 @@ def available_dataloaders() -> List:
     pkgpath = os.path.dirname(__file__)
     dataloaders = [name for _, name, _ in pkgutil.iter_modules([pkgpath])]
     dataloaders.remove("point_cloud2")
+    dataloaders.remove("utils")
     return dataloaders
 
 
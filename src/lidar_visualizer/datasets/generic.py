@@ -20,59 +20,29 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import importlib
-import os
 import sys
 from pathlib import Path
 
-import natsort
 import numpy as np
 
-from lidar_visualizer.datasets import supported_file_extensions
+from lidar_visualizer.datasets.utils import (
+    BaseLidarDataset,
+    colorize_intensity,
+    import_open3d,
+    normalize_intensity,
+)
 
 
-class GenericDataset:
+class GenericDataset(BaseLidarDataset):
     def __init__(self, data_dir: Path, *_, **__):
-        try:
-            self.o3d = importlib.import_module("open3d")
-        except ModuleNotFoundError as e:
-            raise ModuleNotFoundError(
-                "Open3D is not installed on your system, to fix this either "
-                'run "pip install open3d" '
-                "or check https://www.open3d.org/docs/release/getting_started.html"
-            ) from e
-        # Intensity stuff
-        import matplotlib.cm as cm
-
-        self.cmap = cm.viridis
-
-        # Config stuff
-        self.sequence_id = os.path.basename(data_dir)
-        self.scans_dir = os.path.join(os.path.realpath(data_dir), "")
-        self.scan_files = np.array(
-            natsort.natsorted(
-                [
-                    os.path.join(self.scans_dir, fn)
-                    for fn in os.listdir(self.scans_dir)
-                    if any(fn.endswith(ext) for ext in supported_file_extensions())
-                ]
-            ),
-            dtype=str,
-        )
-        if len(self.scan_files) == 0:
-            raise ValueError(f"Tried to read point cloud files in {self.scans_dir} but none found")
-        self.file_extension = self.scan_files[0].split(".")[-1]
-        if self.file_extension not in supported_file_extensions():
-            raise ValueError(f"Supported formats are: {supported_file_extensions()}")
+        self.o3d = import_open3d()
+        super().__init__(data_dir)
 
         # Obtain the pointcloud reader for the given data folder
         self._read_point_cloud = self._get_point_cloud_reader()
 
-    def __len__(self):
-        return len(self.scan_files)
-
-    def __getitem__(self, idx):
-        return self._read_point_cloud(self.scan_files[idx])
+    def _decode(self, file):
+        return self._read_point_cloud(file)
 
     def _get_point_cloud_reader(self):
         """Attempt to guess with try/catch blocks which is the best point cloud reader to use for
@@ -90,13 +60,11 @@ class GenericDataset:
             print("[WARNING] Reading .bin files, the only format supported is the KITTI format")
 
             def read_kitti_scan(file):
-                points_xyzi = (
-                    np.fromfile(file, dtype=np.float32).reshape((-1, 4)).astype(np.float64)
-                )
-                points = points_xyzi[:, 0:3]
-                intensity = points_xyzi[:, -1]
-                intensity = intensity / intensity.max()
-                colors = self.cmap(intensity)[:, :3].reshape(-1, 3)
+                points_xyzi = np.memmap(file, dtype=np.float32, mode="r").reshape((-1, 4))
+                points = self._points_buffer(len(points_xyzi))
+                points[:] = points_xyzi[:, 0:3]
+                intensity = normalize_intensity(points_xyzi[:, -1])
+                colors = colorize_intensity(intensity)
                 return points, colors
 
             return read_kitti_scan
@@ -153,20 +121,23 @@ class GenericDataset:
 
             def read_scan_with_intensities(file):
                 scan = self.o3d.t.io.read_point_cloud(file)
+                # Tensor attributes are exposed as numpy views, no legacy PointCloud needed
+                points = scan.point.positions.numpy()
 
                 if "colors" in dir(scan.point):
-                    scan = scan.to_legacy()
-                    return np.asarray(scan.points), np.asarray(scan.colors)
+                    colors = scan.point.colors.numpy()
+                    # Same normalization to_legacy() applies to integer colors
+                    if np.issubdtype(colors.dtype, np.integer):
+                        colors = colors / np.iinfo(colors.dtype).max
+                    return points, colors
 
                 if "intensity" in dir(scan.point):
-                    intensity = scan.point.intensity.numpy()
-                    intensity = intensity / intensity.max()
-                    colors = self.cmap(intensity)[:, :, :3].reshape(-1, 3)
-                    return scan.point.positions.numpy(), colors
+                    intensity = normalize_intensity(scan.point.intensity.numpy())
+                    colors = colorize_intensity(intensity)
+                    return points, colors
 
                 # else
-                scan = scan.to_legacy()
-                return np.asarray(scan.points), None
+                return points, None
 
             return read_scan_with_intensities
         except ModuleNotFoundError:
@@ -20,92 +20,91 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import os
-import struct
 import sys
 from pathlib import Path
 
-import natsort
 import numpy as np
 
-from lidar_visualizer.datasets import supported_file_extensions
+from lidar_visualizer.datasets.utils import (
+    BaseLidarDataset,
+    colorize_intensity,
+    normalize_intensity,
+    xyz_view,
+)
 
+# Point record layout of each HeLiPR LiDAR, these are the packed equivalents of the struct format
+# strings used by the HeLiPR File Player. Scans are colorized with the "intensity" field, if any
+HELIPR_FIELDS = {
+    "Avia": [
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("reflectivity", np.uint8),
+        ("tag", np.uint8),
+        ("line", np.uint8),
+        ("offset_time", np.uint32),
+    ],
+    "Aeva": [
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("reflectivity", np.float32),
+        ("velocity", np.float32),
+        ("time_offset", np.int32),
+        ("line_index", np.uint8),
+        ("intensity", np.float32),
+    ],
+    "Ouster": [
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("intensity", np.float32),
+        ("t", np.uint32),
+        ("reflectivity", np.uint16),
+        ("ring", np.uint16),
+        ("ambient", np.uint16),
+    ],
+    "Velodyne": [
+        ("x", np.float32),
+        ("y", np.float32),
+        ("z", np.float32),
+        ("intensity", np.float32),
+        ("ring", np.uint16),
+        ("time", np.float32),
+    ],
+}
 
-class HeLiPRDataset:
-    def __init__(self, data_dir: Path, *_, **__):
-        # Intensity stuff
-        import matplotlib.cm as cm
-
-        self.cmap = cm.viridis
 
-        self.sequence_id = os.path.basename(data_dir)
-        self.scan_files = np.array(
-            natsort.natsorted(
-                [
-                    os.path.join(data_dir, fn)
-                    for fn in os.listdir(data_dir)
-                    if any(fn.endswith(ext) for ext in supported_file_extensions())
-                ]
-            ),
-            dtype=str,
-        )
-        if len(self.scan_files) == 0:
-            raise ValueError(f"Tried to read point cloud files in {data_dir} but none found")
-        self.file_extension = self.scan_files[0].split(".")[-1]
-        if self.file_extension not in supported_file_extensions():
-            raise ValueError(f"Supported formats are: {supported_file_extensions()}")
+class HeLiPRDataset(BaseLidarDataset):
+    def __init__(self, data_dir: Path, *_, **__):
+        super().__init__(data_dir)
 
-        # Obtain the pointcloud reader for the given data folder
-        if self.sequence_id == "Avia":
-            self.format_string = "fffBBBL"
-            self.intensity_channel = None
-        elif self.sequence_id == "Aeva":
-            self.format_string = "ffffflBf"
-            self.format_string_no_intensity = "ffffflB"
-            self.intensity_channel = 7
-        elif self.sequence_id == "Ouster":
-            self.format_string = "ffffIHHH"
-            self.intensity_channel = 3
-        elif self.sequence_id == "Velodyne":
-            self.format_string = "ffffHf"
-            self.intensity_channel = 3
-        else:
-            print("[ERROR] Unsupported LiDAR Type")
+        # Obtain the point record layout for the given data folder
+        if self.sequence_id not in HELIPR_FIELDS:
+            print(f"[ERROR] Unsupported LiDAR Type, expected one of: {', '.join(HELIPR_FIELDS)}")
             sys.exit()
+        self.fields = HELIPR_FIELDS[self.sequence_id]
+        self.intensity_field = "intensity"
+        self.dtype = np.dtype(self.fields)
+        self.dtype_no_intensity = np.dtype(
+            [field for field in self.fields if field[0] != self.intensity_field]
+        )
 
-    def __len__(self):
-        return len(self.scan_files)
-
-    def __getitem__(self, idx):
-        return self.read_point_cloud(idx)
-
-    def get_data(self, idx: int):
-        file_path = self.scan_files[idx]
-        list_lines = []
-
+    def get_data(self, file_path: str):
         # Special case, see https://github.com/minwoo0611/HeLiPR-File-Player/blob/e8d95e390454ece1415ae9deb51515f63730c10a/src/ROSThread.cpp#L632
         if self.sequence_id == "Aeva" and int(Path(file_path).stem) <= 1691936557946849179:
-            self.intensity_channel = None
-            format_string = self.format_string_no_intensity
+            dtype = self.dtype_no_intensity
         else:
-            format_string = self.format_string
-
-        chunk_size = struct.calcsize(f"={format_string}")
-        with open(file_path, "rb") as f:
-            binary = f.read()
-            offset = 0
-            while offset < len(binary):
-                list_lines.append(struct.unpack_from(f"={format_string}", binary, offset))
-                offset += chunk_size
-        data = np.stack(list_lines)
-        return data
+            dtype = self.dtype
+        # Map the scan instead of reading it, only the requested fields get copied out
+        return np.memmap(file_path, dtype=dtype, mode="r")
 
-    def read_point_cloud(self, idx: int):
-        data = self.get_data(idx)
-        points = data[:, :3]
+    def _decode(self, file_path: str):
+        data = self.get_data(file_path)
+        points = self._points_buffer(len(data))
+        points[:] = xyz_view(data)
         colors = None
-        if self.intensity_channel is not None:
-            intensity = data[:, self.intensity_channel]
-            intensity = (intensity - intensity.min()) / (intensity.max() - intensity.min())
-            colors = self.cmap(intensity)[:, :3].reshape(-1, 3)
+        if self.intensity_field in data.dtype.names:
+            intensity = normalize_intensity(data[self.intensity_field])
+            colors = colorize_intensity(intensity)
         return points, colors
@@ -21,10 +21,13 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import glob
 import os
+import queue
+import threading
 from typing import Optional
 
+import numpy as np
+
 
 def find_metadata_json(pcap_file: str) -> str:
     """Attempts to resolve the metadata json file for a provided pcap file."""
@@ -33,14 +36,19 @@ def find_metadata_json(pcap_file: str) -> str:
         return ""
     if not dir_path:
         dir_path = os.getcwd()
-    json_candidates = sorted(glob.glob(f"{dir_path}/*.json"))
-    if not json_candidates:
-        return ""
-    prefix_sizes = list(
-        map(lambda p: len(os.path.commonprefix((filename, os.path.basename(p)))), json_candidates)
-    )
-    max_elem = max(range(len(prefix_sizes)), key=lambda i: prefix_sizes[i])
-    return json_candidates[max_elem]
+    # Single pass keeping the json with the longest common prefix, the smallest name wins on ties
+    best_prefix_size, best_name, best_json = -1, "", ""
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # like the former glob pattern, hidden files are not candidates
+            if entry.name.startswith(".") or not entry.name.endswith(".json"):
+                continue
+            prefix_size = len(os.path.commonprefix((filename, entry.name)))
+            if prefix_size > best_prefix_size or (
+                prefix_size == best_prefix_size and entry.name < best_name
+            ):
+                best_prefix_size, best_name, best_json = prefix_size, entry.name, entry.path
+    return best_json
 
 
 class OusterDataloader:
@@ -83,7 +91,7 @@ class OusterDataloader:
             import ouster.pcap as pcap
             from ouster import client
             from ouster.client import _utils
-            from ouster.sdk.examples.colormaps import colorize
+            from ouster.sdk.examples.colormaps import spezia
         except ModuleNotFoundError as e:
             raise ModuleNotFoundError(
                 f'ouster-sdk is not installed on your system, run "pip install ouster-sdk"'
@@ -91,8 +99,6 @@ class OusterDataloader:
 
         # since we import ouster-sdk's client module locally, we keep it locally as well
         self._client = client
-        self._colorize = colorize
-        self._utils = _utils
 
         assert os.path.isfile(data_dir), "Ouster pcap dataloader expects an existing PCAP file"
 
@@ -111,8 +117,25 @@ class OusterDataloader:
             self._info_json = json.read()
             self._info = client.SensorInfo(self._info_json)
 
-        # lookup table for 2D range image projection to a 3D point cloud
-        self._xyz_lut = client.XYZLut(self._info)
+        # lookup table for 2D range image projection to a 3D point cloud. The projection is
+        # xyz = direction * range + offset per pixel, recover both terms from the SDK lookup table
+        # so each scan only projects its valid returns instead of the full H x W image. Zero
+        # ranges are projected to the origin, so sample two non-zero ranges instead
+        h, w = self._info.format.pixels_per_column, self._info.format.columns_per_frame
+        xyz_lut = client.XYZLut(self._info)
+        xyz_1m = xyz_lut(np.full((h, w), 1000, dtype=np.uint32)).reshape((-1, 3))
+        xyz_2m = xyz_lut(np.full((h, w), 2000, dtype=np.uint32)).reshape((-1, 3))
+        xyz_direction = (xyz_2m - xyz_1m) / 1000
+        # float32 is plenty for a viewer (~0.1 mm error) and halves the memory traffic per scan
+        self._xyz_direction = xyz_direction.astype(np.float32)
+        self._xyz_offset = (xyz_1m - 1000 * xyz_direction).astype(np.float32)
+        self._range_field = client.ChanField.RANGE
+
+        # reflectivity colorization, AutoExposure is stateful and is kept across scans so the
+        # exposure stays stable over the recording
+        self._ref_field = client.ChanField.REFLECTIVITY
+        self._ae = _utils.AutoExposure()
+        self._colormap = spezia.astype(np.float32)
 
         self._pcap_file = str(data_dir)
 
@@ -127,23 +150,35 @@ class OusterDataloader:
         self._scans_iter = iter(client.Scans(self._source))
         self._next_idx = 0
 
+        # output buffers reused by every scan, allocated on the first one (H x W points at most)
+        self._points_buffer = np.empty_like(self._xyz_direction)
+        self._offset_buffer = np.empty_like(self._xyz_offset)
+        self._colors_buffer = None
+
+        # decode the next scans from the pcap on a background thread while the current one is
+        # being visualized, bounded so it only runs a couple of scans ahead
+        self._scans_queue = queue.Queue(maxsize=2)
+        self._read_scans_thread = threading.Thread(target=self._read_scans, daemon=True)
+        self._read_scans_thread.start()
+
+    def _read_scans(self):
+        try:
+            for scan in self._scans_iter:
+                self._scans_queue.put(scan)
+        finally:
+            # signal the end of the recording (or a read error) to __getitem__
+            self._scans_queue.put(None)
+
     def get_color_image(self, scan):
         """This function was taken from the Ouster SDK. All rights reserved to Ouster, Inc
         https://github.com/ouster-lidar/ouster_example/blob/master/python/src/ouster/sdk/examples/open3d.py
         """
-        fields = list(scan.fields)
-        aes = {}
-        for field_ind, field in enumerate(fields):
-            if field in (self._client.ChanField.SIGNAL, self._client.ChanField.SIGNAL2):
-                aes[field_ind] = self._utils.AutoExposure(0.02, 0.1, 3)
-            else:
-                aes[field_ind] = self._utils.AutoExposure()
-        field_ind = 2
-
         # Obtain reflectivity for colorizing the cloud
-        key = scan.field(fields[field_ind]).astype(float)
-        aes[field_ind](key)
-        return self._colorize(key)
+        key = scan.field(self._ref_field).astype(np.float32)
+        self._ae(key)
+        # Same lookup as ouster.sdk.examples.colormaps.colorize, but on a float32 colormap
+        key *= 255
+        return self._colormap[key.astype(np.uint8)]
 
     def __getitem__(self, idx):
         # we assume that users always reads sequentially and do not
@@ -152,18 +187,32 @@ class OusterDataloader:
             "Ouster pcap dataloader supports only sequential reads. "
             f"Expected idx: {self._next_idx}, but got {idx}"
         )
-        scan = next(self._scans_iter)
+        scan = self._scans_queue.get()
+        if scan is None:
+            # leave the end marker in place, so any later read also stops instead of blocking
+            self._scans_queue.put(None)
+            raise StopIteration
         self._next_idx += 1
 
         # filtering our zero returns makes it substantially faster for kiss-icp
-        sel_flag = scan.field(self._client.ChanField.RANGE) != 0
-
-        # Extract XYZ and Intensity channels form scan
-        xyz = self._xyz_lut(scan)[sel_flag]
-        ref = self.get_color_image(scan)[sel_flag]
-
-        points = xyz.reshape((-1, 3))
-        colors = ref.reshape((-1, 3))
+        ranges = scan.field(self._range_field).ravel()
+        valid_idx = np.flatnonzero(ranges)
+        n_points = len(valid_idx)
+
+        # Project only the valid returns, straight into the persistent output buffers. mode="clip"
+        # skips the extra buffering np.take does with out= (the indices are always in range)
+        points = self._points_buffer[:n_points]
+        offsets = self._offset_buffer[:n_points]
+        np.take(self._xyz_direction, valid_idx, axis=0, out=points, mode="clip")
+        np.take(self._xyz_offset, valid_idx, axis=0, out=offsets, mode="clip")
+        np.multiply(points, ranges[valid_idx, np.newaxis], out=points, dtype=np.float32)
+        points += offsets
+
+        # Extract Intensity channel form scan
+        ref = self.get_color_image(scan).reshape((-1, 3))
+        if self._colors_buffer is None:
+            self._colors_buffer = np.empty_like(ref)
+        colors = np.take(ref, valid_idx, axis=0, out=self._colors_buffer[:n_points], mode="clip")
 
         return points, colors
 
@@ -36,16 +36,16 @@ The current implementation is based on the one from the KISS-ICP project, but mo
 import sys
 from typing import Iterable, List, Optional
 
-import matplotlib.cm as cm
 import numpy as np
 
+from lidar_visualizer.datasets.utils import colorize_intensity, normalize_intensity
+
 try:
     from rosbags.typesys.types import sensor_msgs__msg__PointCloud2 as PointCloud2
     from rosbags.typesys.types import sensor_msgs__msg__PointField as PointField
 except ModuleNotFoundError as e:
     raise ModuleNotFoundError('rosbags library not installed, run "pip install -U rosbags"') from e
 
-
 _DATATYPES = {}
 _DATATYPES[PointField.INT8] = np.dtype(np.int8)
 _DATATYPES[PointField.UINT8] = np.dtype(np.uint8)
@@ -69,18 +69,15 @@ def read_point_cloud(msg: PointCloud2):
             break
 
     points_structured = read_points(msg, field_names=field_names)
-    points = np.column_stack(
-        [
-            points_structured["x"],
-            points_structured["y"],
-            points_structured["z"],
-        ]
-    ).astype(np.float64)
+    # Fill the columns of the output directly, no intermediate stacked matrix
+    points = np.empty((len(points_structured), 3), dtype=np.float32)
+    points[:, 0] = points_structured["x"]
+    points[:, 1] = points_structured["y"]
+    points[:, 2] = points_structured["z"]
     colors = None
     if intensity_field:
-        intensity = points_structured[intensity_field].astype(np.float64)
-        intensity = intensity / intensity.max()
-        colors = cm.viridis(intensity)[:, :3].reshape(-1, 3)
+        intensity = normalize_intensity(points_structured[intensity_field])
+        colors = colorize_intensity(intensity)
     return points, colors
 
 
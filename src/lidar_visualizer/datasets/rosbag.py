@@ -68,6 +68,8 @@ class RosbagDataset:
 
         # Visualization Options
         self.use_global_visualizer = True
+        # The bag readers keep sqlite connections that only work on the thread that opened them
+        self.thread_safe = False
 
     def __del__(self):
         if hasattr(self, "bag"):
@@ -0,0 +1,146 @@
+# MIT License
+#
+# Copyright (c) 2024 Ignacio Vizzo, Tiziano Guadagnino, Benedikt Mersch, Cyrill
+# Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import abc
+import importlib
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+
+import natsort
+import numpy as np
+
+from lidar_visualizer.datasets import supported_file_extensions
+
+
+@lru_cache(maxsize=None)
+def import_open3d():
+    """Import Open3D once and reuse the module for every dataset that needs it."""
+    try:
+        return importlib.import_module("open3d")
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            "Open3D is not installed on your system, to fix this either "
+            'run "pip install open3d" '
+            "or check https://www.open3d.org/docs/release/getting_started.html"
+        ) from e
+
+
+def list_scan_files(scans_dir: str, extensions: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Return the paths of the files in scans_dir with one of the given extensions, unsorted.
+
+    Extensions are given without the dot and must match exactly, so "robin" or "scan.tbin" are not
+    taken as "bin" files. The directory is walked in a single os.scandir pass.
+    """
+    with os.scandir(scans_dir) as entries:
+        return tuple(
+            entry.path for entry in entries if os.path.splitext(entry.name)[1][1:] in extensions
+        )
+
+
+@lru_cache(maxsize=None)
+def viridis_lut() -> np.ndarray:
+    """RGB lookup table of matplotlib's viridis colormap, shape (256, 3) float32."""
+    import matplotlib.cm as cm
+
+    return cm.viridis(np.arange(cm.viridis.N))[:, :3].astype(np.float32)
+
+
+def xyz_view(records: np.ndarray) -> np.ndarray:
+    """Return the x, y, z fields of a structured array as a strided (N, 3) float32 view.
+
+    The three coordinates must be consecutive float32 fields at the start of each record, so
+    they can be copied out in one strided pass instead of gathering each field separately.
+    """
+    itemsize = records.dtype.itemsize
+    xyz_dtype = np.dtype({"names": ["xyz"], "formats": [(np.float32, 3)], "itemsize": itemsize})
+    return records.view(xyz_dtype)["xyz"]
+
+
+def normalize_intensity(intensity: np.ndarray) -> np.ndarray:
+    """Min-max normalize intensities to [0, 1], returns a new float32 array.
+
+    The input is copied once and rescaled in-place, so no extra temporaries are created.
+    """
+    normalized = np.array(intensity, dtype=np.float32)
+    lower, upper = normalized.min(), normalized.max()
+    normalized -= lower
+    normalized *= 1.0 / (upper - lower) if upper > lower else 0.0
+    return normalized
+
+
+def colorize_intensity(intensity: np.ndarray) -> np.ndarray:
+    """Map intensities normalized to [0, 1] into viridis RGB colors, shape (N, 3).
+
+    Gives the same colors as cm.viridis(intensity)[..., :3] with a single gather from the lookup
+    table, skipping the RGBA float64 allocation and the masking done by matplotlib.
+    """
+    lut = viridis_lut()
+    indices = np.clip(np.ravel(intensity) * len(lut), 0, len(lut) - 1).astype(np.uint8)
+    return lut[indices]
+
+
+class BaseLidarDataset(abc.ABC):
+    """Common logic of the datasets made of one point cloud file per scan.
+
+    Enumerates the scan files in data_dir, subclasses implement _decode(file) -> (points, colors).
+    Reading ahead is left to the Visualizer, which never reads from a dataset concurrently.
+
+    Decoders can fill the points into _points_buffer(n), a ring of reused buffers. The points
+    returned by dataset[i] are therefore aliased: the POINTS_POOL_SIZE-th next decode overwrites
+    them, copy them if they have to outlive that. The ring holds the frame on screen plus the
+    single frame the Visualizer reads ahead, which is never decoded concurrently.
+    """
+
+    POINTS_POOL_SIZE = 2
+
+    def __init__(self, data_dir: Path):
+        self.sequence_id = os.path.basename(os.path.normpath(data_dir))
+        self.scans_dir = os.path.join(os.path.realpath(data_dir), "")
+        self.scan_files = natsort.natsorted(
+            list_scan_files(self.scans_dir, tuple(supported_file_extensions()))
+        )
+        if len(self.scan_files) == 0:
+            raise ValueError(f"Tried to read point cloud files in {self.scans_dir} but none found")
+        # Already one of the supported_file_extensions(), the listing above filtered on them
+        self.file_extension = os.path.splitext(self.scan_files[0])[1][1:]
+
+        # Scans have roughly the same size, reuse the points buffers instead of allocating them
+        self._points_pool = [np.empty((0, 3), dtype=np.float32)] * self.POINTS_POOL_SIZE
+        self._pool_idx = 0
+
+    def __len__(self):
+        return len(self.scan_files)
+
+    def __getitem__(self, idx):
+        return self._decode(self.scan_files[idx])
+
+    @abc.abstractmethod
+    def _decode(self, file: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Read one scan file into (points, colors), colors may be None."""
+
+    def _points_buffer(self, n_points: int) -> np.ndarray:
+        self._pool_idx = (self._pool_idx + 1) % self.POINTS_POOL_SIZE
+        if len(self._points_pool[self._pool_idx]) < n_points:
+            self._points_pool[self._pool_idx] = np.empty((n_points, 3), dtype=np.float32)
+        return self._points_pool[self._pool_idx][:n_points]
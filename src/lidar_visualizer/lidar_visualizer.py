@@ -46,13 +46,14 @@ def version_callback(value: bool):
 
 def guess_dataloader(data: Path, default_dataloader: str):
     if data.is_file():
+        extension = data.suffix[1:]
         if data.name == "metadata.yaml":
             return "rosbag", data.parent  # database is in directory, not in .yml
-        if data.name.split(".")[-1] in "bag":
+        if extension == "bag":
             return "rosbag", data
-        if data.name.split(".")[-1] == "pcap":
+        if extension == "pcap":
             return "ouster", data
-        if data.name.split(".")[-1] == "mcap":
+        if extension == "mcap":
             return "mcap", data
     elif data.is_dir():
         if (data / "metadata.yaml").exists():
@@ -131,6 +132,13 @@ def lidar_visualizer(
         help="[Optional] Specify if you want to start to process scans from a given starting point",
         rich_help_panel="Additional Options",
     ),
+    max_points: int = typer.Option(
+        -1,
+        "--max-points",
+        show_default=False,
+        help="[Optional] Decimate the scans to show at most this many points, default is all",
+        rich_help_panel="Additional Options",
+    ),
     meta: Optional[Path] = typer.Option(
         None,
         "--meta",
@@ -162,6 +170,7 @@ def lidar_visualizer(
         random_accessible_dataset=dataloader in jumpable_dataloaders(),
         n_scans=n_scans,
         jump=jump,
+        max_points=max_points,
     ).run()
 
 
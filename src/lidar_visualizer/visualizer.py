@@ -21,9 +21,18 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import importlib
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    import polyscope
+    from polyscope import imgui
+except ModuleNotFoundError:
+    polyscope = imgui = None
 
 # Button names
 START_BUTTON = "START [SPACE]"
@@ -37,20 +46,51 @@ QUIT_BUTTON = "QUIT [Q]"
 BACKGROUND_COLOR = [0.0, 0.0, 0.0]
 FRAME_COLOR = [0.8470, 0.1058, 0.3764]  # Only used if no color in original cloud
 
+# Polyscope stores the points and colors in single precision, hand them over in that layout
+FRAME_DTYPE = np.float32
+
 # Size constants
 FRAME_PTS_SIZE_N_STEPS = 20
 FRAME_PTS_SIZE_MIN = 0.005
 FRAME_PTS_SIZE_MAX = 0.1
 
 
+class _KeyState(NamedTuple):
+    # Shortcut keys pressed during the current frame, read once per tick
+    space: bool
+    n: bool
+    p: bool
+    c: bool
+    q: bool
+    escape: bool
+    minus: bool
+    equal: bool
+
+
 class Visualizer:
-    def __init__(self, dataset, random_accessible_dataset: bool, n_scans: int = -1, jump: int = 0):
-        try:
-            self._ps = importlib.import_module("polyscope")
-            self._gui = self._ps.imgui
-        except ModuleNotFoundError:
+    def __init__(
+        self,
+        dataset,
+        random_accessible_dataset: bool,
+        n_scans: int = -1,
+        jump: int = 0,
+        max_points: int = -1,
+    ):
+        if polyscope is None:
             print(f'polyscope is not installed on your system, run "pip install polyscope"')
             exit(1)
+        self._ps = polyscope
+        # Same order as the _KeyState fields
+        self._shortcut_keys = (
+            imgui.ImGuiKey_Space,
+            imgui.ImGuiKey_N,
+            imgui.ImGuiKey_P,
+            imgui.ImGuiKey_C,
+            imgui.ImGuiKey_Q,
+            imgui.ImGuiKey_Escape,
+            imgui.ImGuiKey_Minus,
+            imgui.ImGuiKey_Equal,
+        )
 
         # Initialize GUI controls
         self._background_color = BACKGROUND_COLOR
@@ -60,40 +100,64 @@ class Visualizer:
         self._frame_size = 0.5 * FRAME_PTS_SIZE_N_STEPS * self._frame_size_step
         self._play_mode = False
         self._toggle_frame = True
+        self._frame_has_colors = False
+        self._max_points = max_points
+        self._frame_buffers = {}  # Scratch buffers of _to_frame_array, polyscope copies them
+        self._quit_text_width = None
+        self._quitting = False
         self._playback_delay = 0.0
+        self._next_playback_time = time.monotonic()
 
         # Initialize dataset and fix input based on its nature
         self._dataset = dataset
         self._random_accessible_dataset = random_accessible_dataset
+        # Not every dataloader is backed by files (e.g. rosbags, pcaps), resolve that only once
+        self._scan_files = getattr(self._dataset, "scan_files", None)
         self.start_idx = min(jump, len(self._dataset) - 1) if self._random_accessible_dataset else 0
         self.n_scans = len(self._dataset) if n_scans == -1 else min(len(self._dataset), n_scans)
         self.stop_idx = min(len(self._dataset), self.n_scans + self.start_idx)
+        self._span = self.stop_idx - self.start_idx
+        if self._span <= 0:
+            raise ValueError(
+                f"Nothing to visualize, {self.n_scans} scans selected out of {len(self._dataset)}"
+            )
         self.idx = self.start_idx
-        self.current_filename = self._get_current_filename(self.idx)
+        self._current_filename = (None, None)  # (idx, filename), computed on demand
         self.end_reached = False
+        self._idx_dirty = True  # The frame at idx still has to be pushed to polyscope
+
+        # Load the next frame in the background while the current one is on screen. Reads then run
+        # on either the GUI thread or the loader thread (never both at once), dataloaders that are
+        # bound to the thread that opened them (e.g. rosbags' sqlite) set thread_safe = False
+        self._read_ahead = getattr(self._dataset, "thread_safe", True)
+        self._frame_loader = ThreadPoolExecutor(max_workers=1)
+        self._next_frame = None  # (idx, future) of the frame being loaded
 
         # Initialize visualizer
         self._initialize_visualizer()
 
-    def run(self):
-        while True:
-            self.update()
-            self.advance()
+    @property
+    def current_filename(self):
+        # Only needed for display, resolve it when asked and once per frame
+        if self._current_filename[0] != self.idx:
+            self._current_filename = (self.idx, self._get_current_filename(self.idx))
+        return self._current_filename[1]
 
-    def update(self):
+    def run(self):
+        # Polyscope drives the render loop and the playback, through _main_gui_callback
         self._update_visualized_frame()
-        while True:
-            time.sleep(self._playback_delay)
-            self._ps.frame_tick()
-            if self._play_mode and not self.end_reached:
-                break
+        self._ps.show()
+        self._shutdown()
+        raise SystemExit(0)
 
     def advance(self):
-        self.idx = self.start_idx if self.idx == self.stop_idx - 1 else self.idx + 1
+        self.idx = self.start_idx + (self.idx - self.start_idx + 1) % self._span
         self.end_reached = self.idx == self.stop_idx - 1 and not self._random_accessible_dataset
+        self._idx_dirty = True
 
     def rewind(self):
-        self.idx = self.stop_idx - 1 if self.idx == self.start_idx else self.idx - 1
+        self.idx = self.start_idx + (self.idx - self.start_idx - 1) % self._span
+        self._idx_dirty = True
 
     # Private Interface ---------------------------------------------------------------------------
     def _initialize_visualizer(self):
@@ -106,80 +170,164 @@ class Visualizer:
         self._ps.set_build_default_gui_panels(False)
 
     def _get_current_filename(self, idx):
-        # Try to fetch the current filename
-        try:
-            filename = self._dataset.scan_files[idx]
-            return os.path.splitext(os.path.basename(filename))[0]
-        except:
+        if self._scan_files is None:
             return None
+        return os.path.splitext(os.path.basename(self._scan_files[idx]))[0]
 
     def _get_frame(self, idx):
+        # Dataloaders are not reentrant, never read from them while the loader is busy
+        dataframe = None
+        if self._next_frame is not None:
+            next_idx, future = self._next_frame
+            self._next_frame = None
+            if next_idx == idx:
+                dataframe = future.result()
+            elif not future.cancel():
+                wait([future])
+        if dataframe is None:
+            dataframe = self._dataset[idx]
         # Let's do a bit of duck typing to support eating different monsters
-        dataframe = self._dataset[idx]
         points, colors = dataframe
+        # Uniformly decimate huge clouds down to the points budget before they reach the GPU
+        if self._max_points > 0 and len(points) > self._max_points:
+            step = -(-len(points) // self._max_points)
+            points = points[::step]
+            colors = colors[::step] if colors is not None else None
+        points = self._to_frame_array(points, "points")
+        if colors is not None:
+            colors = self._to_frame_array(colors, "colors")
         return points, colors
 
+    def _to_frame_array(self, array, name):
+        # The bundled dataloaders already produce contiguous float32 arrays, pass them as they are
+        if (
+            isinstance(array, np.ndarray)
+            and array.dtype == FRAME_DTYPE
+            and array.flags.c_contiguous
+        ):
+            return array
+        # Otherwise convert into a scratch buffer reused across frames, grown like a std::vector
+        array = np.asarray(array)
+        buffer = self._frame_buffers.get(name)
+        if buffer is None or len(buffer) < len(array):
+            capacity = max(len(array), 2 * len(buffer) if buffer is not None else 0)
+            buffer = self._frame_buffers[name] = np.empty((capacity, 3), dtype=FRAME_DTYPE)
+        np.copyto(buffer[: len(array)], array)
+        return buffer[: len(array)]
+
+    def _load_next_frame(self):
+        # Only start once the current frame is registered, dataloaders may reuse their buffers
+        if (
+            not self._read_ahead
+            or self._quitting
+            or (self.idx == self.stop_idx - 1 and not self._random_accessible_dataset)
+        ):
+            return
+        next_idx = self.start_idx + (self.idx - self.start_idx + 1) % self._span
+        future = self._frame_loader.submit(self._dataset.__getitem__, next_idx)
+        self._next_frame = (next_idx, future)
+
     def _update_visualized_frame(self):
-        self.current_filename = self._get_current_filename(self.idx)
+        self._idx_dirty = False
         points, colors = self._get_frame(self.idx)
         self._register_frame(points, colors)
+        self._load_next_frame()
+
+    def _shutdown(self):
+        # Drop the pending frame and the scratch buffers, the loader only finishes its current read
+        if self._next_frame is not None:
+            self._next_frame[1].cancel()
+            self._next_frame = None
+        self._frame_loader.shutdown(wait=False)
+        self._frame_buffers.clear()
+        if self._ps.has_point_cloud("current_frame"):
+            self._ps.remove_point_cloud("current_frame")
 
     def _register_frame(self, points, colors):
-        frame_cloud = self._ps.register_point_cloud(
-            "current_frame",
-            points,
-            point_render_mode="quad",
-        )
-        if colors is None:
-            frame_cloud.set_color(FRAME_COLOR)
+        frame_cloud = None
+        if self._ps.has_point_cloud("current_frame"):
+            frame_cloud = self._ps.get_point_cloud("current_frame")
+        # Reuse the GPU buffers of the previous frame when the number of points does not change
+        if frame_cloud is not None and frame_cloud.n_points() == len(points):
+            frame_cloud.update_point_positions(points)
         else:
+            frame_cloud = self._ps.register_point_cloud(
+                "current_frame",
+                points,
+                point_render_mode="quad",
+            )
+            # A new cloud starts from scratch, the controls only touch the registered one
+            frame_cloud.set_color(FRAME_COLOR)
+            frame_cloud.set_radius(self._frame_size, relative=False)
+            frame_cloud.set_enabled(self._toggle_frame)
+            self._frame_has_colors = False
+        if colors is not None:
             frame_cloud.add_color_quantity("colors", colors, enabled=True)
-        frame_cloud.set_radius(self._frame_size, relative=False)
-        frame_cloud.set_enabled(self._toggle_frame)
+        elif self._frame_has_colors:
+            frame_cloud.remove_quantity("colors")
+        self._frame_has_colors = colors is not None
 
     # GUI Callbacks ---------------------------------------------------------------------------
     def _main_gui_callback(self):
-        self._gui.TextUnformatted("Controls:")
+        # unshow() only takes effect at the end of the frame, do not draw or load anything else
+        if self._quitting:
+            return
+        is_key_pressed = imgui.IsKeyPressed
+        keys = _KeyState(*(is_key_pressed(key) for key in self._shortcut_keys))
+        self._playback_callback()
+        imgui.TextUnformatted("Controls:")
         if not self.end_reached:
-            self._start_pause_callback()
+            self._start_pause_callback(keys)
             if not self._play_mode:
-                self._gui.SameLine()
-                self._next_frame_callback()
+                imgui.SameLine()
+                self._next_frame_callback(keys)
                 if self._random_accessible_dataset:
-                    self._gui.SameLine()
-                    self._previous_frame_callback()
-        self._gui.Separator()
+                    imgui.SameLine()
+                    self._previous_frame_callback(keys)
+        imgui.Separator()
         self._progress_bar_callback()
         self._playback_delay_callback()
-        self._gui.Separator()
-        self._gui.TextUnformatted("Scene Options:")
+        imgui.Separator()
+        imgui.TextUnformatted("Scene Options:")
         self._background_color_callback()
-        self._points_controlles_callback()
+        self._points_controlles_callback(keys)
         if not self._random_accessible_dataset:
-            self._gui.Separator()
+            imgui.Separator()
             self._information_callback()
-        self._gui.Separator()
-        self._center_viewpoint_callback()
-        self._gui.SameLine()
-        self._quit_callback()
+        imgui.Separator()
+        self._center_viewpoint_callback(keys)
+        imgui.SameLine()
+        self._quit_callback(keys)
+        # Push the frame once per tick, and only if some control moved idx
+        if self._idx_dirty and not self._quitting:
+            self._update_visualized_frame()
 
-    def _start_pause_callback(self):
+    def _playback_callback(self):
+        if not self._play_mode or self.end_reached:
+            return
+        # Wait for the playback deadline without blocking the UI, and without accumulating drift
+        if self._playback_delay > 0.0:
+            now = time.monotonic()
+            if now < self._next_playback_time:
+                return
+            self._next_playback_time = max(now, self._next_playback_time) + self._playback_delay
+        self.advance()
+
+    def _start_pause_callback(self, keys):
         button_name = PAUSE_BUTTON if self._play_mode else START_BUTTON
-        if self._gui.Button(button_name) or self._gui.IsKeyPressed(self._gui.ImGuiKey_Space):
+        if imgui.Button(button_name) or keys.space:
             self._play_mode = not self._play_mode
 
-    def _next_frame_callback(self):
-        if self._gui.Button(NEXT_FRAME_BUTTON) or self._gui.IsKeyPressed(self._gui.ImGuiKey_N):
+    def _next_frame_callback(self, keys):
+        if imgui.Button(NEXT_FRAME_BUTTON) or keys.n:
             self.advance()
-            self._update_visualized_frame()
 
-    def _previous_frame_callback(self):
-        if self._gui.Button(PREVIOUS_FRAME_BUTTON) or self._gui.IsKeyPressed(self._gui.ImGuiKey_P):
+    def _previous_frame_callback(self, keys):
+        if imgui.Button(PREVIOUS_FRAME_BUTTON) or keys.p:
             self.rewind()
-            self._update_visualized_frame()
 
     def _progress_bar_callback(self):
-        changed, idx = self._gui.SliderInt(
+        changed, idx = imgui.SliderInt(
             f"\t{self.stop_idx} Frames###Progress Bar",
             self.idx,
             v_min=self.start_idx,
@@ -188,10 +336,10 @@ class Visualizer:
         )
         if changed and self._random_accessible_dataset:
             self.idx = idx
-            self._update_visualized_frame()
+            self._idx_dirty = True
 
     def _playback_delay_callback(self):
-        _, self._playback_delay = self._gui.SliderFloat(
+        _, self._playback_delay = imgui.SliderFloat(
             "\tPlayback Delay",
             self._playback_delay,
             v_min=0.0,
@@ -199,22 +347,22 @@ class Visualizer:
             format="%.2f s",
         )
 
-    def _points_controlles_callback(self):
+    def _points_controlles_callback(self, keys):
         key_changed = False
-        if self._gui.IsKeyPressed(self._gui.ImGuiKey_Minus):
+        if keys.minus:
             self._frame_size = max(FRAME_PTS_SIZE_MIN, self._frame_size - self._frame_size_step)
             key_changed = True
-        if self._gui.IsKeyPressed(self._gui.ImGuiKey_Equal):
+        if keys.equal:
             self._frame_size = min(FRAME_PTS_SIZE_MAX, self._frame_size + self._frame_size_step)
             key_changed = True
-        changed, self._frame_size = self._gui.SliderFloat(
+        changed, self._frame_size = imgui.SliderFloat(
             "Points Size", self._frame_size, v_min=FRAME_PTS_SIZE_MIN, v_max=FRAME_PTS_SIZE_MAX
         )
         if changed or key_changed:
             self._ps.get_point_cloud("current_frame").set_radius(self._frame_size, relative=False)
 
     def _background_color_callback(self):
-        changed, self._background_color = self._gui.ColorEdit3(
+        changed, self._background_color = imgui.ColorEdit3(
             "Background Color",
             self._background_color,
         )
@@ -222,30 +370,27 @@ class Visualizer:
             self._ps.set_background_color(self._background_color)
 
     def _information_callback(self):
-        self._gui.TextUnformatted(
+        imgui.TextUnformatted(
             f"[WARNING] The current dataloader does not allow you to access frames\nrandomly..."
         )
 
-    def _center_viewpoint_callback(self):
-        if self._gui.Button(CENTER_VIEWPOINT_BUTTON) or self._gui.IsKeyPressed(
-            self._gui.ImGuiKey_C
-        ):
+    def _center_viewpoint_callback(self, keys):
+        if imgui.Button(CENTER_VIEWPOINT_BUTTON) or keys.c:
             self._ps.reset_camera_to_home_view()
 
-    def _quit_callback(self):
+    def _quit_callback(self, keys):
+        # The label never changes, measure it only once (needs a live ImGui context)
+        if self._quit_text_width is None:
+            self._quit_text_width = imgui.CalcTextSize(QUIT_BUTTON)[0]
         posX = (
-            self._gui.GetCursorPosX()
-            + self._gui.GetColumnWidth()
-            - self._gui.CalcTextSize(QUIT_BUTTON)[0]
-            - self._gui.GetScrollX()
-            - self._gui.ImGuiStyleVar_ItemSpacing
+            imgui.GetCursorPosX()
+            + imgui.GetColumnWidth()
+            - self._quit_text_width
+            - imgui.GetScrollX()
+            - imgui.ImGuiStyleVar_ItemSpacing
         )
-        self._gui.SetCursorPosX(posX)
-        if (
-            self._gui.Button(QUIT_BUTTON)
-            or self._gui.IsKeyPressed(self._gui.ImGuiKey_Escape)
-            or self._gui.IsKeyPressed(self._gui.ImGuiKey_Q)
-        ):
+        imgui.SetCursorPosX(posX)
+        if imgui.Button(QUIT_BUTTON) or keys.escape or keys.q:
             print("Destroying Visualizer")
+            self._quitting = True
             self._ps.unshow()
-            os._exit(0)